@@ -4,6 +4,7 @@ import os
 import json
 import unicodedata
 import re
+import threading
 from datetime import datetime
 
 app = Flask(__name__)
@@ -20,11 +21,12 @@ def _write_data(filepath, data):
     os.makedirs(address_history_dir, exist_ok=True)
 
     # Sauvegarder la version actuelle si elle existe
+    last_change = datetime.now()
     if os.path.exists(filepath):
         with open(filepath, 'r', encoding='utf-8') as f:
             current_data = f.read()
         
-        timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S') # Format plus détaillé et parsable
+        timestamp = last_change.strftime('%Y-%m-%d_%H-%M-%S') # Format plus détaillé et parsable
         backup_path = os.path.join(address_history_dir, f"{timestamp}.json")
         with open(backup_path, 'w', encoding='utf-8') as f:
             f.write(current_data)
@@ -33,6 +35,9 @@ def _write_data(filepath, data):
     with open(filepath, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
+    # Mettre à jour l'index des résidents sans rescanner toutes les adresses
+    update_resident_index(address_id, data, last_change.replace(microsecond=0))
+
 def slugify(value):
     """
     Convertit une chaîne de caractères en un "slug" sécurisé pour un nom de fichier.
@@ -44,6 +49,169 @@ def slugify(value):
     value = re.sub(r'[-\s]+', '_', value)
     return value
 
+
+# --- Index des résidents (détection des doublons entre adresses) ---
+# Clé normalisée du nom -> {address_id: [(bâtiment, numéro, nom tel que saisi), ...]}
+_resident_index = {}
+# address_id -> {'name': adresse complète, 'keys': clés indexées, 'last_change': datetime}
+_indexed_addresses = {}
+_resident_index_lock = threading.Lock()
+_resident_index_ready = threading.Event()
+_resident_index_job = None
+
+def _normalize_resident_name(name):
+    """
+    Normalise un nom de résident pour la comparaison (accents, casse, espaces).
+    Ex: "  Élodie   DUPONT " -> "elodie_dupont"
+    """
+    return slugify(name)
+
+def _latest_history_timestamp(address_id):
+    """Retourne la date de la dernière version sauvegardée d'une adresse, ou None."""
+    address_history_dir = os.path.join(HISTORY_DIR, address_id)
+    if not os.path.exists(address_history_dir):
+        return None
+    latest = None
+    for filename in os.listdir(address_history_dir):
+        if filename.endswith('.json'):
+            try:
+                dt_obj = datetime.strptime(filename.replace('.json', ''), '%Y-%m-%d_%H-%M-%S')
+            except ValueError:
+                continue # Ignorer les fichiers mal formés
+            if latest is None or dt_obj > latest:
+                latest = dt_obj
+    return latest
+
+def _unindex_address(address_id):
+    """Retire toutes les entrées d'une adresse de l'index. Doit être appelée sous le verrou."""
+    meta = _indexed_addresses.pop(address_id, None)
+    if meta is None:
+        return
+    for key in meta['keys']:
+        by_address = _resident_index.get(key)
+        if by_address is None:
+            continue
+        by_address.pop(address_id, None)
+        if not by_address:
+            del _resident_index[key]
+
+def _index_address(address_id, address_data, last_change):
+    """(Ré)indexe les résidents d'une adresse. Doit être appelée sous le verrou."""
+    # Collecter d'abord les entrées : si les données sont malformées, l'index reste intact
+    new_entries = []
+    for batiment in address_data.get('batiments', []):
+        for boite in batiment.get('boites', []):
+            for resident in boite.get('residents', []):
+                key = _normalize_resident_name(resident)
+                if key:
+                    new_entries.append((key, (batiment.get('nom'), boite.get('numero'), resident)))
+    address_name = address_data.get('adresse_complete', 'Adresse inconnue')
+
+    _unindex_address(address_id)
+    for key, entry in new_entries:
+        _resident_index.setdefault(key, {}).setdefault(address_id, []).append(entry)
+    _indexed_addresses[address_id] = {
+        'name': address_name,
+        'keys': {key for key, _ in new_entries},
+        'last_change': last_change,
+    }
+
+def update_resident_index(address_id, address_data, last_change=None):
+    """
+    Met à jour l'index de manière incrémentale après l'écriture d'une adresse.
+    Une erreur d'indexation est journalisée mais ne fait pas échouer l'enregistrement.
+    """
+    try:
+        if last_change is None:
+            last_change = _latest_history_timestamp(address_id)
+        with _resident_index_lock:
+            _index_address(address_id, address_data, last_change)
+    except Exception:
+        app.logger.exception("Impossible d'indexer les résidents de l'adresse %s", address_id)
+
+def remove_from_resident_index(address_id):
+    """Retire une adresse de l'index (suppression ou renommage)."""
+    with _resident_index_lock:
+        _unindex_address(address_id)
+
+def _build_resident_index():
+    """Tâche de fond : indexe toutes les adresses existantes une seule fois au démarrage."""
+    try:
+        try:
+            filenames = sorted(os.listdir(DATA_DIR))
+        except FileNotFoundError:
+            filenames = []
+        for filename in filenames:
+            if not filename.endswith('.json'):
+                continue
+            address_id = filename.replace('.json', '')
+            filepath = os.path.join(DATA_DIR, filename)
+            try:
+                last_change = _latest_history_timestamp(address_id)
+                # Lecture sous le verrou : une écriture concurrente ne peut pas être écrasée par des données périmées
+                with _resident_index_lock:
+                    if address_id in _indexed_addresses:
+                        continue # Déjà indexée par une écriture plus récente
+                    try:
+                        with open(filepath, 'r', encoding='utf-8') as f:
+                            address_data = json.load(f)
+                    except FileNotFoundError:
+                        continue # Fichier supprimé entre-temps
+                    if last_change is None:
+                        last_change = datetime.fromtimestamp(os.path.getmtime(filepath)).replace(microsecond=0)
+                    _index_address(address_id, address_data, last_change)
+            except Exception:
+                app.logger.exception("Adresse %s ignorée lors de l'indexation des résidents", address_id)
+    finally:
+        _resident_index_ready.set()
+
+def start_resident_index_job():
+    """Lance la construction initiale de l'index dans un thread d'arrière-plan (une seule fois)."""
+    global _resident_index_job
+    with _resident_index_lock:
+        if _resident_index_job is not None:
+            return
+        _resident_index_job = threading.Thread(target=_build_resident_index, name='resident-index', daemon=True)
+    _resident_index_job.start()
+
+def find_resident_duplicates():
+    """
+    Retourne les résidents présents dans plusieurs adresses ou bâtiments,
+    triés par date de dernière modification la plus récente.
+    """
+    duplicates = []
+    with _resident_index_lock:
+        for key, by_address in _resident_index.items():
+            locations = {(address_id, entry[0]) for address_id, entries in by_address.items() for entry in entries}
+            if len(locations) < 2:
+                continue
+            occurrences = []
+            for address_id, entries in by_address.items():
+                meta = _indexed_addresses[address_id]
+                for batiment_nom, numero, nom in entries:
+                    occurrences.append({
+                        'address_id': address_id,
+                        'address_name': meta['name'],
+                        'building_name': batiment_nom,
+                        'numero': numero,
+                        'name': nom,
+                        'last_change': meta['last_change'],
+                    })
+            duplicates.append({'key': key, 'occurrences': occurrences})
+
+    for duplicate in duplicates:
+        duplicate['occurrences'].sort(key=lambda o: o['last_change'] or datetime.min, reverse=True)
+        duplicate['last_change'] = duplicate['occurrences'][0]['last_change']
+        duplicate['names'] = sorted({o['name'] for o in duplicate['occurrences']})
+        for occurrence in duplicate['occurrences']:
+            if occurrence['last_change'] is not None:
+                occurrence['display_time'] = occurrence['last_change'].strftime('%d/%m/%Y à %Hh%Mmin%Ss')
+            else:
+                occurrence['display_time'] = 'inconnue'
+    duplicates.sort(key=lambda d: d['key'])
+    duplicates.sort(key=lambda d: d['last_change'] or datetime.min, reverse=True)
+    return duplicates
+
 @app.route('/')
 def index():
     """Affiche la page d'accueil avec la liste des adresses."""
@@ -94,6 +262,7 @@ def new_address():
             # Pas de sauvegarde ici car le fichier est nouveau
             with open(filepath, 'w', encoding='utf-8') as f:
                 json.dump(new_data, f, ensure_ascii=False, indent=2)
+            update_resident_index(file_id, new_data, datetime.now().replace(microsecond=0))
 
         return redirect(url_for('index'))
 
@@ -170,6 +339,9 @@ def edit_address(address_id):
                 # Ensuite, nous devons écrire le fichier avec le nouveau nom.
                 with open(new_filepath, 'w', encoding='utf-8') as f:
                     json.dump(address_data, f, ensure_ascii=False, indent=2)
+
+                remove_from_resident_index(address_id)
+                update_resident_index(new_file_id, address_data)
                 
                 address_id = new_file_id # Mettre à jour l'ID pour la redirection
             
@@ -592,6 +764,7 @@ def delete_address(address_id):
         abort(404)
 
     os.remove(filepath) # Supprimer le fichier JSON de l'adresse
+    remove_from_resident_index(address_id)
 
     # Supprimer le répertoire d'historique si il existe
     if os.path.exists(history_dir_path):
@@ -643,8 +816,18 @@ def restore_version(address_id, version_id):
     return redirect(url_for('show_address', address_id=address_id))
 
 
+@app.route('/residents/duplicates')
+def resident_duplicates():
+    """Affiche les résidents présents dans plusieurs adresses ou bâtiments (déménagements)."""
+    start_resident_index_job()
+    # Attendre un peu la fin de l'indexation initiale, puis afficher des résultats partiels
+    indexing = not _resident_index_ready.wait(timeout=5)
+    return render_template('resident_duplicates.html', duplicates=find_resident_duplicates(), indexing=indexing)
+
+
 if __name__ == '__main__':
     os.makedirs(DATA_DIR, exist_ok=True)
     os.makedirs(HISTORY_DIR, exist_ok=True)
+    start_resident_index_job()
     app.run(debug=True, host='0.0.0.0', port=5000)
 